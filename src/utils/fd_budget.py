@@ -0,0 +1,166 @@
+"""
+File descriptor budget for the File Sorter CLI tool.
+
+Limits how many files and directories may be open at the same time, so
+concurrent scanning, copying and hashing wait for a free slot instead of
+failing with "Too many open files" (EMFILE).
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None  # type: ignore[assignment]
+
+DEFAULT_FD_LIMIT = 512  # Used when the OS limit can't be read (e.g. Windows)
+MAX_FD_LIMIT = 65536  # Upper bound for the soft limit, whatever the hard limit is
+RESERVED_FDS = 32  # Kept free for stdio, logging, event loop internals, etc.
+
+
+def raise_fd_soft_limit():
+    """Raise the open files soft limit (capped by MAX_FD_LIMIT) and return the result"""
+    if resource is None:
+        return DEFAULT_FD_LIMIT
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = MAX_FD_LIMIT if hard == resource.RLIM_INFINITY else min(hard, MAX_FD_LIMIT)
+    if soft == resource.RLIM_INFINITY or soft >= wanted:
+        return wanted
+
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+    except (ValueError, OSError) as exc:
+        logging.warning(
+            "Could not raise open files limit from %s to %s: %s", soft, wanted, exc
+        )
+        return soft
+    return wanted
+
+
+class FileDescriptorBudget:
+    """
+    Shared pool of file descriptor slots for all concurrent file operations.
+
+    Pass the open files limit explicitly, e.g. the value returned by
+    raise_fd_soft_limit() called once at startup.
+    """
+
+    def __init__(self, limit, reserved=RESERVED_FDS):
+        self.capacity = max(1, limit - reserved)
+        self._semaphore = asyncio.Semaphore(self.capacity)
+        self._multi_slot_lock = asyncio.Lock()
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._acquired = 0
+        self._waited = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    @asynccontextmanager
+    async def slot(self, count=1):
+        """
+        Hold `count` descriptor slots, waiting while none are free.
+
+        Take all descriptors an operation needs in a single call, e.g. slot(2)
+        for a copy's source and destination. Don't nest slot() calls: a task
+        holding a slot and waiting for another can hang once the budget is used up.
+        """
+        if count < 1:
+            raise ValueError(f"Requested {count} descriptor slots, at least 1 is needed")
+        if count > self.capacity:
+            raise ValueError(
+                f"Requested {count} descriptor slots, budget capacity is {self.capacity}"
+            )
+
+        started = time.perf_counter()
+        blocked = False
+        taken = 0
+        try:
+            if count == 1:
+                blocked = self._semaphore.locked()
+                await self._semaphore.acquire()
+                taken = 1
+            else:
+                # Only one task gathers several slots at a time, otherwise two of
+                # them could each hold part of what they need and wait forever
+                blocked = self._multi_slot_lock.locked()
+                async with self._multi_slot_lock:
+                    for _ in range(count):
+                        blocked = blocked or self._semaphore.locked()
+                        await self._semaphore.acquire()
+                        taken += 1
+            self._record_acquire(count, blocked, time.perf_counter() - started)
+            yield
+        finally:
+            for _ in range(taken):
+                self._semaphore.release()
+            if taken == count:
+                self._in_use -= count
+
+    async def scandir(self, path):
+        """List directory entries, keeping the directory handle open only while reading"""
+        async with self.slot():
+            reading = asyncio.ensure_future(asyncio.to_thread(_read_dir_entries, path))
+            try:
+                return await asyncio.shield(reading)
+            except asyncio.CancelledError:
+                # The thread keeps the directory open until it is done reading,
+                # so hold the slot until then
+                while not reading.done():
+                    try:
+                        await asyncio.wait({reading})
+                    except asyncio.CancelledError:
+                        pass
+                if not reading.cancelled():
+                    reading.exception()  # Mark as retrieved, the caller is cancelled anyway
+                raise
+
+    def stats(self):
+        """Return budget usage and time spent waiting for free slots"""
+        return {
+            "capacity": self.capacity,
+            "in_use": self._in_use,
+            "peak_in_use": self._peak_in_use,
+            "acquired": self._acquired,
+            "waited": self._waited,
+            "wait_time": self._wait_time,
+            "max_wait_time": self._max_wait_time,
+        }
+
+    def log_stats(self):
+        """Log budget usage, hinting when the descriptor limit capped throughput"""
+        stats = self.stats()
+        logging.info(
+            "File descriptor budget: capacity %d, peak %d, %d of %d acquisitions waited "
+            "(total %.3fs, max %.3fs)",
+            stats["capacity"],
+            stats["peak_in_use"],
+            stats["waited"],
+            stats["acquired"],
+            stats["wait_time"],
+            stats["max_wait_time"],
+        )
+        if stats["waited"]:
+            logging.info(
+                "Open files limit capped concurrency, raise 'ulimit -n' to go faster"
+            )
+
+    def _record_acquire(self, count, blocked, wait_time):
+        self._in_use += count
+        self._peak_in_use = max(self._peak_in_use, self._in_use)
+        self._acquired += 1
+        if blocked:
+            self._waited += 1
+            self._wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+
+
+def _read_dir_entries(path):
+    """Read all entries of a directory and close its handle right away"""
+    with os.scandir(path) as entries:
+        return list(entries)
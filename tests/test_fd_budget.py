@@ -0,0 +1,205 @@
+"""Tests for the file descriptor budget."""
+
+import asyncio
+import threading
+import unittest
+from unittest import mock
+
+from utils import fd_budget
+from utils.fd_budget import FileDescriptorBudget, raise_fd_soft_limit
+
+
+class FileDescriptorBudgetTest(unittest.IsolatedAsyncioTestCase):
+    """Slot handling and wait accounting of FileDescriptorBudget"""
+
+    async def test_callers_wait_when_budget_is_used_up(self):
+        budget = FileDescriptorBudget(limit=2, reserved=0)
+        running = 0
+        peak = 0
+
+        async def worker():
+            nonlocal running, peak
+            async with budget.slot():
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(worker() for _ in range(6)))
+
+        stats = budget.stats()
+        self.assertEqual(peak, 2)
+        self.assertEqual(stats["peak_in_use"], 2)
+        self.assertEqual(stats["in_use"], 0)
+        self.assertEqual(stats["acquired"], 6)
+
+    async def test_slots_released_when_body_raises(self):
+        budget = FileDescriptorBudget(limit=1, reserved=0)
+
+        with self.assertRaises(OSError):
+            async with budget.slot():
+                raise OSError("copy failed")
+
+        self.assertEqual(budget.stats()["in_use"], 0)
+        async with asyncio.timeout(1):
+            async with budget.slot():
+                pass
+
+    async def test_slots_released_when_cancelled_while_waiting(self):
+        budget = FileDescriptorBudget(limit=3, reserved=0)
+        release = asyncio.Event()
+
+        async def holder():
+            async with budget.slot(2):
+                await release.wait()
+
+        async def waiter():
+            async with budget.slot(2):
+                pass
+
+        holder_task = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        waiter_task = asyncio.create_task(waiter())
+        await asyncio.sleep(0.01)
+        waiter_task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter_task
+
+        self.assertEqual(budget.stats()["in_use"], 2)
+        release.set()
+        await holder_task
+        self.assertEqual(budget.stats()["in_use"], 0)
+        async with asyncio.timeout(1):
+            async with budget.slot(3):
+                pass
+
+    async def test_wait_accounting(self):
+        budget = FileDescriptorBudget(limit=1, reserved=0)
+
+        async with budget.slot():
+            pass
+        self.assertEqual(budget.stats()["waited"], 0)
+        self.assertEqual(budget.stats()["wait_time"], 0.0)
+
+        async def hold():
+            async with budget.slot():
+                await asyncio.sleep(0.05)
+
+        await asyncio.gather(hold(), hold())
+
+        stats = budget.stats()
+        self.assertEqual(stats["acquired"], 3)
+        self.assertEqual(stats["waited"], 1)
+        self.assertGreater(stats["wait_time"], 0.03)
+        self.assertEqual(stats["max_wait_time"], stats["wait_time"])
+
+    async def test_multi_slot_callers_do_not_deadlock(self):
+        budget = FileDescriptorBudget(limit=4, reserved=0)
+
+        async def worker(count):
+            async with budget.slot(count):
+                await asyncio.sleep(0.001)
+
+        counts = [4, 3, 3, 2, 1, 2, 3, 1, 4, 2] * 5
+        async with asyncio.timeout(5):
+            await asyncio.gather(*(worker(count) for count in counts))
+
+        stats = budget.stats()
+        self.assertEqual(stats["in_use"], 0)
+        self.assertLessEqual(stats["peak_in_use"], 4)
+        self.assertEqual(stats["acquired"], len(counts))
+
+    async def test_invalid_slot_counts_fail(self):
+        budget = FileDescriptorBudget(limit=2, reserved=0)
+
+        for count in (3, 0, -3):
+            with self.subTest(count=count), self.assertRaises(ValueError):
+                async with budget.slot(count):
+                    pass
+
+        stats = budget.stats()
+        self.assertEqual(stats["in_use"], 0)
+        self.assertEqual(stats["acquired"], 0)
+
+    async def test_scandir_keeps_slot_until_cancelled_read_finishes(self):
+        budget = FileDescriptorBudget(limit=1, reserved=0)
+        reading = threading.Event()
+        finish = threading.Event()
+
+        def slow_read(path):
+            reading.set()
+            finish.wait(5)
+            return []
+
+        with mock.patch.object(fd_budget, "_read_dir_entries", slow_read):
+            task = asyncio.create_task(budget.scandir("."))
+            await asyncio.to_thread(reading.wait, 5)
+            task.cancel()
+            await asyncio.sleep(0.01)
+
+            self.assertFalse(task.done())
+            self.assertEqual(budget.stats()["in_use"], 1)
+
+            finish.set()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        self.assertEqual(budget.stats()["in_use"], 0)
+
+
+@unittest.skipIf(fd_budget.resource is None, "resource module is not available")
+class RaiseFdSoftLimitTest(unittest.TestCase):
+    """Soft limit raising with mocked resource limits"""
+
+    def setUp(self):
+        self.infinity = fd_budget.resource.RLIM_INFINITY
+
+    def test_infinite_hard_limit_is_capped(self):
+        with mock.patch.object(
+            fd_budget.resource, "getrlimit", return_value=(1024, self.infinity)
+        ), mock.patch.object(fd_budget.resource, "setrlimit") as setrlimit:
+            self.assertEqual(raise_fd_soft_limit(), fd_budget.MAX_FD_LIMIT)
+
+        setrlimit.assert_called_once_with(
+            fd_budget.resource.RLIMIT_NOFILE, (fd_budget.MAX_FD_LIMIT, self.infinity)
+        )
+
+    def test_finite_hard_limit_below_cap(self):
+        with mock.patch.object(
+            fd_budget.resource, "getrlimit", return_value=(1024, 4096)
+        ), mock.patch.object(fd_budget.resource, "setrlimit") as setrlimit:
+            self.assertEqual(raise_fd_soft_limit(), 4096)
+
+        setrlimit.assert_called_once_with(
+            fd_budget.resource.RLIMIT_NOFILE, (4096, 4096)
+        )
+
+    def test_large_finite_hard_limit_is_capped(self):
+        with mock.patch.object(
+            fd_budget.resource, "getrlimit", return_value=(1024, 2**30)
+        ), mock.patch.object(fd_budget.resource, "setrlimit") as setrlimit:
+            self.assertEqual(raise_fd_soft_limit(), fd_budget.MAX_FD_LIMIT)
+
+        setrlimit.assert_called_once_with(
+            fd_budget.resource.RLIMIT_NOFILE, (fd_budget.MAX_FD_LIMIT, 2**30)
+        )
+
+    def test_soft_limit_already_high_enough(self):
+        with mock.patch.object(
+            fd_budget.resource, "getrlimit", return_value=(2**20, 2**20)
+        ), mock.patch.object(fd_budget.resource, "setrlimit") as setrlimit:
+            self.assertEqual(raise_fd_soft_limit(), fd_budget.MAX_FD_LIMIT)
+
+        setrlimit.assert_not_called()
+
+    def test_failed_setrlimit_keeps_current_soft_limit(self):
+        with mock.patch.object(
+            fd_budget.resource, "getrlimit", return_value=(1024, 4096)
+        ), mock.patch.object(
+            fd_budget.resource, "setrlimit", side_effect=ValueError("not allowed")
+        ), self.assertLogs(level="WARNING"):
+            self.assertEqual(raise_fd_soft_limit(), 1024)
+
+
+if __name__ == "__main__":
+    unittest.main()